@@ -1,29 +1,58 @@
-import noise
+import numpy as np
 import pyaudio
-import struct
+import codecs
 import math
+import os
+import queue
+import select
 import time
 import sys
 
+from numba import njit, float32, float64
+
+from perlin1d import pnoise1, pnoise1_array, PERIOD as PERLIN_PERIOD
+
 # At the rate we are going, this is exactly one seconds worth of data.
 SAMPLE_RATE = 44100
 
 SAMPLE_SIZE = 4
 FRAME_SIZE = SAMPLE_SIZE
 
+# Largest callback we allocate room for up front, one second.
+MAX_FRAMES = SAMPLE_RATE
+
+# Frames PyAudio asks for in each callback, we generate buffers this size.
+FRAMES_PER_BUFFER = 1024
+
+# How many generated buffers can wait for the audio thread.
+QUEUED_BUFFERS = 2
+
+# Seconds to wait for a command before generating more audio.
+POLL_INTERVAL = .01
+
+# Read the noise out of a precomputed table instead of generating it for
+# every sample. Set to False to go back to generating it, if the table ever
+# changes the sound too much.
+NOISE_WAVETABLE = True
+
+# Entries in the table, which covers one whole period of the noise. Must be a
+# power of two.
+NOISE_TABLE_SIZE = 1 << 16
+
 # Frequency in hertz
 START_FREQUENCY = 220
 
 # Hz / second
-ANIM_RATE = 1
+ANIM_RATE = 500
 
 class FreqConst:
     def __init__(self):
         pass
     def is_done(self):
         return False
-    def next(self, dt, old_val):
-        return old_val
+    def generate_ramp(self, out, sample_rate, start_freq):
+        out.fill(start_freq)
+        return start_freq
 
 class FreqAnimator:
 
@@ -32,81 +61,144 @@ class FreqAnimator:
     DONE_STATE = 'done'
 
     def __init__(self, rate, *states):
-        self.states = list(states)
+        # Each hertz we move through, in order, as either 1 or -1. States of 0
+        # don't add anything, we've already technically satisfied them.
+        self.deltas = np.repeat(np.sign(states), np.abs(states)).astype(np.int32)
         # Amount of time in seconds to add a hertz.
         self.time_step = 1 / rate
 
+        # 1 to follow the states as given, -1 to mirror them.
+        self.sign = 1
+
         # We are only partially initialized, we only start when the user first
-        # calls next.
+        # calls generate_ramp.
         self.anim_state = FreqAnimator.INIT_STATE
 
-    def reset(self):
+    def reset(self, sign=1):
+        self.sign = sign
         self.anim_state = FreqAnimator.INIT_STATE
 
     def is_done(self):
         return self.anim_state == FreqAnimator.DONE_STATE
 
-    def next(self, dt, old_val):
+    def generate_ramp(self, out, sample_rate, start_freq):
+        """Writes the frequency of each of the next len(out) samples into out
+        and returns the frequency we end up at afterwards."""
         if self.anim_state == FreqAnimator.INIT_STATE:
             # This is our starting value!
-            self.cur_value = old_val
+            self.cur_value = start_freq
 
-            # Move towards the goal of state 0, starting without progress.
-            self.state_i = 0
-            self.state_progress = 0
-            self.accum_time = 0.0
+            # Start at the first step, without progress towards it.
+            self.delta_i = 0
+            self.accum_samples = 0.0
 
             # We are not done, and not partially initialized, which is sorta
             # what the init state signifies
             self.anim_state = FreqAnimator.RUNNING_STATE
 
-        # As long as we are not done, do stuff, otherwise skip it all
-        if self.anim_state != FreqAnimator.DONE_STATE:
-            # Accumulate the time
-            self.accum_time += dt
-
-            # Time to do something
-            if self.accum_time >= self.time_step:
-                # We handled some time, so remove it for next time
-                self.accum_time -= self.time_step
-
-                # How much do we have to add total?
-                goal = self.states[self.state_i]
-
-                if goal == 0:
-                    # Skip this state, and move on, since we've already technically
-                    # satisfied it.
-                    state += 1
-                else:
-                    # This will either be 1 or -1, it tells us how much to add to the
-                    # old value.
-                    direction = goal // abs(goal)
-
-                    # How much have we moved?
-                    self.state_progress += direction
-
-                    # Do the move
-                    self.cur_value += direction
-
-                    # Haved we moved enough?
-                    if abs(self.state_progress) >= abs(goal):
-                        # Continue to the next state.
-                        self.state_i += 1
-                        # Reset our progress, but not our accumulated time.
-                        self.state_progress = 0
-
-                        if self.state_i >= len(self.states):
-                            # We've gone through every state
-                            self.anim_state = FreqAnimator.DONE_STATE
-
-        # When we are done, this will just stay constant, so we don't have to
-        # worry about it.
+        self.delta_i, self.accum_samples, self.cur_value = fill_ramp(
+            out, self.deltas, self.sign, self.delta_i, self.accum_samples,
+            sample_rate * self.time_step, self.cur_value)
+
+        if self.delta_i >= len(self.deltas):
+            # We've gone through every step
+            self.anim_state = FreqAnimator.DONE_STATE
+
         return self.cur_value
 
-def square(t, f):
-    return 4 / math.pi * (math.sin(2 * math.pi *  f * t) +
-                          1 / 3 * math.sin(6 * math.pi * f * t) +
-                          1 / 5 * math.sin(10 * math.pi * f * t))
+@njit(nogil=True, cache=True)
+def fill_ramp(out, deltas, sign, delta_i, accum, samples_per_step, value):
+    # Write the frequency of each sample into out, taking the next step of
+    # deltas (times sign) every samples_per_step samples. Returns where we
+    # left off.
+    for i in range(out.size):
+        out[i] = value
+
+        if delta_i < deltas.size:
+            accum += 1.0
+            if accum >= samples_per_step:
+                accum -= samples_per_step
+                value += sign * deltas[delta_i]
+                delta_i += 1
+
+    return delta_i, accum, value
+
+# One period of the noise, sampled once when we start up. Left empty when
+# the table is turned off, noise_lookup is never called then.
+if NOISE_WAVETABLE:
+    NOISE_TABLE = pnoise1_array(
+        np.arange(NOISE_TABLE_SIZE) * (PERLIN_PERIOD / NOISE_TABLE_SIZE)
+    ).astype(np.float32)
+else:
+    NOISE_TABLE = np.empty(0, dtype=np.float32)
+
+@njit(cache=True, fastmath=True)
+def noise_lookup(phase):
+    # Linearly interpolate between the two closest entries of the table.
+    x = phase * (NOISE_TABLE_SIZE / PERLIN_PERIOD)
+    # Round down, not towards zero, so negative phases interpolate too.
+    xf = math.floor(x)
+    i = int(xf)
+    frac = x - xf
+
+    a = NOISE_TABLE[i & (NOISE_TABLE_SIZE - 1)]
+    b = NOISE_TABLE[(i + 1) & (NOISE_TABLE_SIZE - 1)]
+    return a + frac * (b - a)
+
+# Constants used by square, so they aren't recomputed for every sample.
+_TWO_PI = 2.0 * math.pi
+_FOUR_OVER_PI = 4.0 / math.pi
+_ONE_THIRD = 1.0 / 3.0
+_ONE_FIFTH = 1.0 / 5.0
+
+@njit(cache=True, fastmath=True)
+def square(s):
+    # s is sin(w), get sin(3w) and sin(5w) from it without calling sin again.
+    s2 = s * s
+    s3 = s * (3.0 - 4.0 * s2)
+    s5 = s * (5.0 + s2 * (16.0 * s2 - 20.0))
+    return _FOUR_OVER_PI * (s + _ONE_THIRD * s3 + _ONE_FIFTH * s5)
+
+@njit(float64(float32[:], float32[:], float64), nogil=True, cache=True,
+      fastmath=True)
+def fill_frame(out, freqs, phase):
+    # Generate one sample per element of out, freqs holds the frequency of
+    # each one and phase is how many cycles in we are at the first. Returns
+    # the phase to start the next frame at.
+    # Samples are only ever float32, but the phase and the oscillator are
+    # kept as float64, since they need the precision.
+
+    # Sine and cosine of the oscillator's angle, starting from the phase
+    # every frame keeps rounding errors from building up.
+    s = math.sin(_TWO_PI * phase)
+    c = math.cos(_TWO_PI * phase)
+
+    # Rotation applied to (s, c) every sample, only changes with frequency.
+    f = freqs[0]
+    sin_dw = math.sin(_TWO_PI * f / SAMPLE_RATE)
+    cos_dw = math.cos(_TWO_PI * f / SAMPLE_RATE)
+
+    for i in range(out.size):
+        if freqs[i] != f:
+            f = freqs[i]
+            sin_dw = math.sin(_TWO_PI * f / SAMPLE_RATE)
+            cos_dw = math.cos(_TWO_PI * f / SAMPLE_RATE)
+
+        if NOISE_WAVETABLE:
+            noise = noise_lookup(phase)
+        else:
+            noise = pnoise1(phase)
+
+        val = square(s) * .02 + noise * .98
+        out[i] = val * 1.1
+
+        # Advance by one sample.
+        phase += f / SAMPLE_RATE
+        s, c = s * cos_dw + c * sin_dw, c * cos_dw - s * sin_dw
+
+    # The noise repeats after PERLIN_PERIOD cycles, and so does the square
+    # wave, so wrap around there to keep the phase small.
+    return phase % PERLIN_PERIOD
 
 class InactiveGeneratorError(Exception):
     pass
@@ -119,17 +211,23 @@ class GeneratorAudio:
     STATE_GOING_DOWN = 'down'
 
     def __init__(self, cur_freq = START_FREQUENCY, anim_rate = ANIM_RATE):
-        self.last_time = 0.0
-        self.buf = bytearray(0)
+        # Cycles of the current frequency we've gone through.
+        self._phase = 0.0
+        self._buf = np.empty(MAX_FRAMES, dtype=np.float32)
+        # Scratch space for the frequency of each sample.
+        self._freqs = np.empty(MAX_FRAMES, dtype=np.float32)
         self.state = GeneratorAudio.STATE_OFF
         self.cur_freq = cur_freq
 
         self.const_freq_anim = FreqConst()
-        self.up_freq_anim = FreqAnimator(anim_rate, 100, -150, 70)
-        self.down_freq_anim = FreqAnimator(anim_rate, -100, 150, -70)
+        # Going down is the same animation as going up, just mirrored.
+        self.freq_anim = FreqAnimator(anim_rate, 100, -150, 70)
 
         self.debug_file = None
 
+        # Buffers generated on the main thread, waiting to be played.
+        self._frames = queue.Queue(maxsize=QUEUED_BUFFERS)
+
     def write_audio(self, fo):
         self.debug_file = fo
 
@@ -137,7 +235,7 @@ class GeneratorAudio:
         if self.is_active():
             if self.state != GeneratorAudio.STATE_GOING_UP:
                 # Reset animation.
-                self.up_freq_anim.reset()
+                self.freq_anim.reset(1)
 
             self.state = GeneratorAudio.STATE_GOING_UP
         else:
@@ -147,7 +245,7 @@ class GeneratorAudio:
         if self.is_active():
             if self.state != GeneratorAudio.STATE_GOING_DOWN:
                 # Reset animation.
-                self.down_freq_anim.reset()
+                self.freq_anim.reset(-1)
 
             self.state = GeneratorAudio.STATE_GOING_DOWN
         else:
@@ -163,55 +261,63 @@ class GeneratorAudio:
         if self.is_active():
             self.state = GeneratorAudio.STATE_OFF
 
+    def prepare_next_buffer(self):
+        # Generate audio ahead of time until the audio thread has enough
+        # waiting for it.
+        while not self._frames.full():
+            if self.is_active():
+                # Noises
+                data = self.aud_cb(FRAMES_PER_BUFFER)
+            else:
+                # Silence
+                data = bytes(FRAMES_PER_BUFFER * FRAME_SIZE)
+            self._frames.put_nowait(data)
+
     def pa_callback(self, in_data, frame_count, time_info, status):
-        if self.is_active():
-            # Return noises
-            return self.aud_cb(frame_count), pyaudio.paContinue
-        else:
-            # Return silence
+        try:
+            # Everything was already generated, just hand it over.
+            return self._frames.get_nowait(), pyaudio.paContinue
+        except queue.Empty:
+            # We fell behind, return silence
             return bytes(frame_count * FRAME_SIZE), pyaudio.paContinue
 
     def aud_cb(self, frame_count):
-        # Resize the buffer if necessary.
-        if frame_count * FRAME_SIZE != len(self.buf):
-            self.buf = bytearray(frame_count * FRAME_SIZE)
+        # Only grow the buffer if PyAudio asks for more than we planned for,
+        # so the audio thread normally never allocates it.
+        if frame_count > len(self._buf):
+            self._buf = np.empty(frame_count, dtype=np.float32)
+            self._freqs = np.empty(frame_count, dtype=np.float32)
+        out = self._buf[:frame_count]
+        freq_array = self._freqs[:frame_count]
 
         freq = self.cur_freq
 
         freq_anim = self.const_freq_anim
-        if self.state == GeneratorAudio.STATE_GOING_UP:
-            # We are going up, set up that 'animator'.
-            freq_anim = self.up_freq_anim
-        elif self.state == GeneratorAudio.STATE_GOING_DOWN:
-            # We are going down, etc.
-            freq_anim = self.down_freq_anim
+        if self.state in (GeneratorAudio.STATE_GOING_UP,
+                          GeneratorAudio.STATE_GOING_DOWN):
+            # We are going up or down, step_up and step_down already pointed
+            # the 'animator' the right way.
+            freq_anim = self.freq_anim
 
-        # Generate some data
-        for i in range(frame_count):
-            dt = i / SAMPLE_RATE
-            cur_time = self.last_time + dt
+        # Figure out the frequency of every sample first.
+        freq = freq_anim.generate_ramp(freq_array, SAMPLE_RATE, freq)
 
-            val = square(cur_time, freq) * .02 + \
-                  noise.pnoise1(cur_time * freq, octaves=5,
-                                persistence=.95,lacunarity=2.0) * .98
-            val *= 1.1
-            struct.pack_into('<f', self.buf, FRAME_SIZE * i, val)
-
-            freq = freq_anim.next(dt, freq)
+        # If it's done, it's time to go back to constant
+        if freq_anim.is_done():
+            self.state = GeneratorAudio.STATE_STEADY
 
-            # If it's done, it's time to go back to constant
-            if freq_anim.is_done():
-                self.state = GeneratorAudio.STATE_STEADY
-                freq_anim = self.const_freq_anim
+        # Generate some data
+        self._phase = fill_frame(out, freq_array, self._phase)
 
-        self.last_time = cur_time
         self.cur_freq = freq
 
+        buf = out.tobytes()
+
         # Write data and return data.
         if self.debug_file:
-            self.debug_file.write(self.buf)
+            self.debug_file.write(buf)
 
-        return bytes(self.buf)
+        return buf
 
 if __name__ == '__main__':
     p = pyaudio.PyAudio()
@@ -219,15 +325,55 @@ if __name__ == '__main__':
     eng = GeneratorAudio()
     eng.write_audio(open('debug_audio.raw', 'wb'))
 
+    # Have something ready before the first callback.
+    eng.prepare_next_buffer()
+
     stream = p.open(format=pyaudio.paFloat32, channels=1,
                     rate=SAMPLE_RATE, output=True,
+                    frames_per_buffer=FRAMES_PER_BUFFER,
                     stream_callback=eng.pa_callback)
     stream.start_stream()
 
+    # Only bother flushing output right away when someone is typing commands,
+    # not when they are piped in.
+    interactive = sys.stdin.isatty()
+
+    prompt = True
+    # Input we've read but haven't run yet, stdin may give us several lines
+    # at once, or only part of one.
+    pending = ''
+    # Reads can end in the middle of a character, so decode across them.
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
     while stream.is_active():
         try:
-            # How nice, a command prompt!
-            cmd = input('> ')
+            if prompt:
+                # How nice, a command prompt!
+                sys.stdout.write('> ')
+                if interactive:
+                    sys.stdout.flush()
+                prompt = False
+
+            # Keep the audio thread fed while we wait for a command.
+            eng.prepare_next_buffer()
+
+            if '\n' not in pending:
+                ready, _, _ = select.select([sys.stdin], [], [], POLL_INTERVAL)
+                if not ready:
+                    continue
+
+                raw = os.read(sys.stdin.fileno(), 4096)
+                data = decoder.decode(raw, final=not raw)
+                if not raw:
+                    # Out of input, run whatever is left and quit.
+                    pending += data
+                    data = '\nquit\n' if pending else 'quit\n'
+                pending += data
+
+                if '\n' not in pending:
+                    continue
+
+            prompt = True
+            cmd, pending = pending.split('\n', 1)
         except KeyboardInterrupt:
             # Clear the line so the user's prompt doesn't show up on the same
             # line.
@@ -237,17 +383,17 @@ if __name__ == '__main__':
 
         # Step up the "engine"
         if cmd == 'start':
-            print('Starting engine...')
+            sys.stdout.write('Starting engine...\n')
             eng.start()
         elif cmd == 'stop':
-            print('Stopping engine...')
+            sys.stdout.write('Stopping engine...\n')
             eng.stop()
         elif cmd == 'step':
-            print('Stepping up...')
+            sys.stdout.write('Stepping up...\n')
             eng.step_up()
         # Step down the "engine"
         elif cmd == 'down':
-            print('Stepping down...')
+            sys.stdout.write('Stepping down...\n')
             eng.step_down()
         # Print engine information
         elif cmd == 'status':
@@ -255,15 +401,16 @@ if __name__ == '__main__':
             pass
         # Quit the program
         elif cmd == "quit":
-            print("Quitting...")
+            sys.stdout.write("Quitting...\n")
             break
         # Read the source code!
         elif cmd == 'help':
-            print('No help for you!')
+            sys.stdout.write('No help for you!\n')
         else:
-            print('Unknown command, try again!')
+            sys.stdout.write('Unknown command, try again!\n')
 
-        print('Engine state:', eng.state, 'Freq:', eng.cur_freq)
+        # Not flushed here, the prompt does that if anyone is watching.
+        sys.stdout.write(f'Engine state: {eng.state} Freq: {eng.cur_freq}\n')
 
     # Clean up
     stream.stop_stream()
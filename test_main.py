@@ -0,0 +1,44 @@
+import numpy as np
+
+from main import FreqAnimator, SAMPLE_RATE, noise_lookup
+from perlin1d import pnoise1_array
+
+# Fast enough that every test animation finishes within a second of samples.
+RATE = 1000
+
+def run_to_completion(anim, start_freq, frame_count=1024, max_frames=100):
+    out = np.empty(frame_count, dtype=np.float32)
+    freq = start_freq
+    for _ in range(max_frames):
+        freq = anim.generate_ramp(out, SAMPLE_RATE, freq)
+        if anim.is_done():
+            return freq, out
+    raise AssertionError('animation never finished')
+
+def test_leading_zero_state():
+    anim = FreqAnimator(RATE, 0, 100)
+    freq, _ = run_to_completion(anim, 220)
+    assert freq == 320
+    assert anim.is_done()
+
+def test_trailing_zero_state():
+    anim = FreqAnimator(RATE, 100, 0)
+    freq, _ = run_to_completion(anim, 220)
+    assert freq == 320
+    assert anim.is_done()
+
+def test_all_zero_states():
+    anim = FreqAnimator(RATE, 0, 0)
+    out = np.empty(1024, dtype=np.float32)
+    freq = anim.generate_ramp(out, SAMPLE_RATE, 220)
+
+    # Nothing to do, so we are done after the very first frame.
+    assert anim.is_done()
+    assert freq == 220
+    assert (out == 220).all()
+
+def test_noise_lookup_negative_phase():
+    phases = np.linspace(-3, 3, 1001)
+    expected = pnoise1_array(phases)
+    actual = np.array([noise_lookup(x) for x in phases])
+    assert np.abs(actual - expected).max() < 5e-3